@@ -1,7 +1,86 @@
-import num2words
-import dateutil.parser
-import pint
 import re
+import hashlib
+import math
+
+# counts distinct (string) values in bounded memory
+# values are counted exactly (in a set) until there are more than exact_limit of them, after which they are counted by a
+# HyperLogLog sketch of 2 ** precision one-byte registers, whose relative standard error is about 1.04 / sqrt(2 ** precision)
+# (e.g. 16 KB and 0.81% for precision 14), see https://en.wikipedia.org/wiki/HyperLogLog
+class DistinctCounter:
+    def __init__(self, exact_limit=100000, precision=14):
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.exact_values = set()
+        self.registers = None  # only allocated once exact_limit is exceeded
+        self.num_adds_since_estimate = 0
+        self.last_estimate = 0
+
+    def add(self, value):
+        if self.registers == None:
+            self.exact_values.add(value)
+            if len(self.exact_values) > self.exact_limit:
+                self.switch_to_sketch()
+        else:
+            self.add_to_sketch(value)
+            self.num_adds_since_estimate += 1
+
+    # adds the values counted by @other (with the same exact_limit and precision) to this counter
+    # sketches merge by taking the max of each register, so merging is exact in the sense that the result is the same
+    # sketch as if all values had been added to one counter
+    def merge(self, other):
+        if other.registers == None:
+            for value in other.exact_values:
+                self.add(value)
+            return
+        if self.registers == None:
+            self.switch_to_sketch()
+        for register_idx in range(len(self.registers)):
+            if other.registers[register_idx] > self.registers[register_idx]:
+                self.registers[register_idx] = other.registers[register_idx]
+        self.num_adds_since_estimate = 0
+        self.last_estimate = self.estimate()
+
+    def switch_to_sketch(self):
+        self.registers = bytearray(2 ** self.precision)
+        for exact_value in self.exact_values:
+            self.add_to_sketch(exact_value)
+        self.exact_values = None
+        self.last_estimate = self.estimate()
+
+    def add_to_sketch(self, value):
+        # not hash(), which is randomized per process for strings, so that estimates (and classifications) are reproducible
+        hash_value = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        num_rest_bits = 64 - self.precision
+        register_idx = hash_value >> num_rest_bits
+        rest = hash_value & ((1 << num_rest_bits) - 1)
+        rank = num_rest_bits - rest.bit_length() + 1  # position of the leftmost 1 bit in rest
+        if rank > self.registers[register_idx]:
+            self.registers[register_idx] = rank
+
+    def estimate(self):
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        raw_estimate = alpha * num_registers * num_registers / sum(2.0 ** -rank for rank in self.registers)
+        num_zero_registers = self.registers.count(0)
+        if raw_estimate <= 2.5 * num_registers and num_zero_registers > 0:  # small range correction (linear counting)
+            return num_registers * math.log(num_registers / num_zero_registers)
+        return raw_estimate
+
+    # exact while counting exactly, otherwise an estimate
+    def count(self):
+        if self.registers == None:
+            return len(self.exact_values)
+        self.num_adds_since_estimate = 0
+        self.last_estimate = self.estimate()
+        return self.last_estimate
+
+    # cheap version of count (for calling after every add), whose estimate is only refreshed every 2 ** precision adds
+    def recent_count(self):
+        if self.registers == None:
+            return len(self.exact_values)
+        if self.num_adds_since_estimate >= len(self.registers):
+            return self.count()
+        return self.last_estimate
 
 class Classifier:
     # @max_records_checked: max number of records we check for a specific format
@@ -11,21 +90,57 @@ class Classifier:
     # @ordinal_bound: bound for which we will be able to recognize ordinals
     # @categorical_distinctness_threshold: upper bound on fraction of distinct/total to be classified as categorical
     #   - higher values mean we accept more things to be categorical
+    # @categorical_exact_limit: max number of distinct records counted exactly by the categorical checker, see DistinctCounter
+    #   - above this, distinct records are estimated in constant memory, with a relative standard error of 1.04 / sqrt(2 ** categorical_sketch_precision)
+    # @categorical_sketch_precision: log2 of the number of registers of that estimate
     # @year_bounds: tuple of (start_year, end_year) inclusive that we should classify quantitative columns as years (temporal) instead
     def __init__(self, max_records_checked=None,
                        threshold_for_match=1.0,
                        ordinal_bound=1000,
                        categorical_distinctness_threshold=0.2,
+                       categorical_exact_limit=100000,
+                       categorical_sketch_precision=14,
                        year_bounds=(1000, 2100)):
         self.max_records_checked = max_records_checked
         self.threshold_for_match = threshold_for_match
-        self.ordinals = set()
-        for i in range(ordinal_bound):
-            self.ordinals.add(num2words.num2words(i, to="ordinal").lower())
-            self.ordinals.add(num2words.num2words(i, to="ordinal_num"))
+        self.ordinal_bound = ordinal_bound
+        self.ordinals = None  # built on first use, see get_ordinals
+        self.ureg = None  # built on first use, see get_unit_registry
         self.categorical_distinctness_threshold = categorical_distinctness_threshold
+        self.categorical_exact_limit = categorical_exact_limit
+        self.categorical_sketch_precision = categorical_sketch_precision
         self.year_bounds = year_bounds
 
+    # the heavy dependencies (num2words, dateutil, pint) are only imported by the checkers that need them, on first use
+    # so that importing this module and constructing a Classifier stays cheap
+    def get_ordinals(self):
+        if self.ordinals == None:
+            import num2words
+            self.ordinals = set()
+            for i in range(self.ordinal_bound):
+                self.ordinals.add(num2words.num2words(i, to="ordinal").lower())
+                self.ordinals.add(num2words.num2words(i, to="ordinal_num"))
+        return self.ordinals
+
+    def get_unit_registry(self):
+        if self.ureg == None:
+            import pint
+            self.ureg = pint.UnitRegistry()
+        return self.ureg
+
+    # the lazily built state is left out when a Classifier is sent to worker processes, which build their own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["ordinals"] = None
+        state["ureg"] = None
+        return state
+
+    # builds everything that is otherwise built on first use, for long-lived processes that want to pay for it upfront
+    def warm(self):
+        import dateutil.parser
+        self.get_ordinals()
+        self.get_unit_registry()
+
     # taken from https://stackoverflow.com/questions/5319922/python-check-if-word-is-in-a-string
     def find_whole_word(self, w):
         return re.compile(r'\b({0})\b'.format(w), flags=re.IGNORECASE).search
@@ -48,100 +163,289 @@ class Classifier:
     #  - "CATEGORICAL"
     #  - "STRING"
     def classify(self, col_idx, header, records):
-        # some tables have the first column corresponding to row number
-        if col_idx == 0:
-            is_row_num = True
-            for record_idx in range(len(records)):
-                try:
-                    record_num = float(records[record_idx].replace(",", "").replace(" ", ""))
-                except ValueError:
-                    is_row_num = False
-                    break
-                else:
-                    if record_idx + 1 != record_num:
-                        is_row_num = False
-                        break
-            if is_row_num:
-                # but sometimes this just corresponds to rank or position
-                if header.lower() == "rank" or header.lower() == "position" or header.lower() == "pos":
-                    return "ORDINAL"
-                else:
-                    return "ROW_NUM"
-
         # determining number of records to check
         if self.max_records_checked == None:
             records_to_check = len(records)
         else:
             records_to_check = min(self.max_records_checked, len(records))
+        checked_records = records if records_to_check == len(records) else records[:records_to_check]
 
-        # ordinal checker
-        num_ordinals_found = 0
-        for record_idx in range(records_to_check):
-            if records[record_idx].lower() in self.ordinals:
-                num_ordinals_found += 1
-        if num_ordinals_found >= self.threshold_for_match * records_to_check:
-            return "ORDINAL"
+        # checkers only run when classify_counts gets to them, so e.g. an ordinal column never gets parsed by pint
+        counts = dict()
+        def get_count(checker):
+            if checker not in counts:
+                if checker == "row_num":
+                    counts[checker] = self.check_row_num(records)
+                elif checker == "distinct":
+                    counts[checker] = self.count_distinct(records)
+                else:
+                    counts[checker] = self.count_matches(checker, checked_records)
+            return counts[checker]
+        return self.classify_counts(col_idx, header, len(records), records_to_check, get_count)
 
-        # temporal checker
-        num_temporals_found = 0
-        for record_idx in range(records_to_check):
+    # returns the partial state of classify for one chunk of a column (its records in file order, without the header)
+    # so that the chunks of a column can be summarized by different processes, see merge_summaries and classify_summary
+    # unlike classify, this runs every checker on every record, since it cannot know which checkers the whole column needs
+    def summarize(self, col_idx, records):
+        summary = {"num_records": len(records)}
+        if col_idx == 0:
+            summary["row_num"] = self.summarize_row_num(records)
+        summary["distinct"] = DistinctCounter(self.categorical_exact_limit, self.categorical_sketch_precision)
+        for record in records:
+            summary["distinct"].add(record)
+        if self.max_records_checked == None:
+            summary["counts"] = {checker: self.count_matches(checker, records) for checker in self.match_checkers}
+        else:  # only the first records of the whole column are checked, which are among the first records of each chunk
+            summary["head_records"] = records[:self.max_records_checked]
+        return summary
+
+    # merges the summaries of the chunks of a column, in file order, into the summary of the whole column
+    def merge_summaries(self, col_idx, summaries):
+        merged = {"num_records": 0, "distinct": DistinctCounter(self.categorical_exact_limit, self.categorical_sketch_precision)}
+        if col_idx == 0:
+            merged["is_row_num"] = True
+        if self.max_records_checked == None:
+            merged["counts"] = dict()
+        else:
+            merged["head_records"] = []
+        for summary in summaries:
+            if col_idx == 0 and summary["num_records"] > 0:  # each chunk has to continue the numbering of the previous ones
+                (first_num, is_consecutive) = summary["row_num"]
+                if not is_consecutive or first_num != merged["num_records"] + 1:
+                    merged["is_row_num"] = False
+            merged["num_records"] += summary["num_records"]
+            merged["distinct"].merge(summary["distinct"])
+            if self.max_records_checked == None:
+                for (checker, count) in summary["counts"].items():
+                    merged["counts"][checker] = self.add_counts(merged["counts"].get(checker), count)
+            else:
+                merged["head_records"].extend(summary["head_records"][:self.max_records_checked - len(merged["head_records"])])
+        return merged
+
+    # classifies a column from its merged summary (see merge_summaries), the same way classify would from its records
+    def classify_summary(self, col_idx, header, summary):
+        if self.max_records_checked == None:
+            records_to_check = summary["num_records"]
+        else:
+            records_to_check = min(self.max_records_checked, summary["num_records"])
+
+        head_counts = dict()
+        def get_count(checker):
+            if checker == "row_num":
+                return summary["is_row_num"]
+            elif checker == "distinct":
+                return summary["distinct"].count()
+            elif self.max_records_checked == None:
+                return summary["counts"][checker]
+            if checker not in head_counts:
+                head_counts[checker] = self.count_matches(checker, summary["head_records"])
+            return head_counts[checker]
+        return self.classify_counts(col_idx, header, summary["num_records"], records_to_check, get_count)
+
+    # auxiliary function
+    # sums two results of count_matches for the same checker (@count_a may be None)
+    def add_counts(self, count_a, count_b):
+        if count_a == None:
+            return count_b
+        elif isinstance(count_b, dict):
+            summed = dict(count_a)
+            for (key, count) in count_b.items():
+                summed[key] = summed.get(key, 0) + count
+            return summed
+        elif isinstance(count_b, tuple):
+            return tuple(a + b for (a, b) in zip(count_a, count_b))
+        return count_a + count_b
+
+    # auxiliary function
+    # whether records are 1, 2, 3, ... (a row number)
+    def check_row_num(self, records):
+        for record_idx in range(len(records)):
             try:
-                # ensures that dateutil is not just recognizing one random float as a date
-                float(records[record_idx].replace(",", "").replace(" ", ""))
+                record_num = float(records[record_idx].replace(",", "").replace(" ", ""))
             except ValueError:
-                try:
-                    dateutil.parser.parse(records[record_idx])
-                except ValueError:
-                    pass
-                else:
-                    num_temporals_found += 1
-        if num_temporals_found >= self.threshold_for_match * records_to_check and "score" not in header.lower():
-            return "TEMPORAL"
+                return False
+            else:
+                if record_idx + 1 != record_num:
+                    return False
+        return True
 
-        # temporal range checker
-        num_temporal_ranges_found = 0
-        for record_idx in range(records_to_check):
-            if records[record_idx].count("-") == 1:
-                (first, second) = records[record_idx].split("-")
+    # auxiliary function
+    # returns (first_num, is_consecutive) for a chunk of a column, i.e. whether its records are first_num, first_num + 1, ...
+    def summarize_row_num(self, records):
+        first_num = None
+        for record_idx in range(len(records)):
+            try:
+                record_num = float(records[record_idx].replace(",", "").replace(" ", ""))
+            except ValueError:
+                return (first_num, False)
+            if first_num == None:
+                first_num = record_num
+            elif first_num + record_idx != record_num:
+                return (first_num, False)
+        return (first_num, True)
+
+    # auxiliary function
+    # counts distinct records, stopping as soon as there are too many distinct records to be categorical
+    def count_distinct(self, records):
+        distinct_cutoff = self.categorical_distinctness_threshold * len(records)
+        distinct_records = DistinctCounter(self.categorical_exact_limit, self.categorical_sketch_precision)
+        for record in records:
+            distinct_records.add(record)
+            if distinct_records.recent_count() >= distinct_cutoff:
+                break
+        return distinct_records.count()
+
+    # the checkers of count_matches, which run on the records to check (see max_records_checked)
+    match_checkers = ["ordinal", "temporal", "temporal_range", "quant_range", "money", "percent", "units", "numbers"]
+
+    # auxiliary function
+    # runs one of match_checkers on @records, returning
+    #  - the number of matching records for "ordinal", "temporal", "temporal_range", "money", and "percent"
+    #  - (num_ranges, num_year_ranges) for "quant_range"
+    #  - a dict of unit (string) to number of records in that unit for "units"
+    #  - (num_floats, num_ints, num_years) for "numbers"
+    def count_matches(self, checker, records):
+        if checker == "ordinal":
+            ordinals = self.get_ordinals()
+            num_ordinals_found = 0
+            for record in records:
+                if record.lower() in ordinals:
+                    num_ordinals_found += 1
+            return num_ordinals_found
+
+        elif checker == "temporal":
+            import dateutil.parser
+            num_temporals_found = 0
+            for record in records:
                 try:
-                    # ensures that dateutil is not just recognizing random floats as a date
-                    float(first.replace(",", "").replace(" ", ""))
-                    float(second.replace(",", "").replace(" ", ""))
+                    # ensures that dateutil is not just recognizing one random float as a date
+                    float(record.replace(",", "").replace(" ", ""))
                 except ValueError:
                     try:
-                        first_date = dateutil.parser.parse(first)
-                        second_date = dateutil.parser.parse(second)
+                        dateutil.parser.parse(record)
                     except ValueError:
                         pass
                     else:
-                        if second_date >= first_date:  # only makes sense for a range
-                            num_temporal_ranges_found += 1
-        if num_temporal_ranges_found >= self.threshold_for_match * records_to_check:
-            return "TEMPORAL_RANGE"
+                        num_temporals_found += 1
+            return num_temporals_found
 
-        # quant range checker
-        num_quant_ranges_found = 0
-        num_can_be_years_found = 0
-        for record_idx in range(records_to_check):
-            if records[record_idx].count("-") == 1:
-                (first, second) = records[record_idx].split("-")
-                try:
-                    first_float = float(first.replace(",", "").replace(" ", ""))
-                    second_float = float(second.replace(",", "").replace(" ", ""))
-                except ValueError:
-                    pass
-                else:
-                    if second_float >= first_float:  # only makes sense for a range
-                        num_quant_ranges_found += 1
-                        # check if this can be a year range
+        elif checker == "temporal_range":
+            import dateutil.parser
+            num_temporal_ranges_found = 0
+            for record in records:
+                if record.count("-") == 1:
+                    (first, second) = record.split("-")
+                    try:
+                        # ensures that dateutil is not just recognizing random floats as a date
+                        float(first.replace(",", "").replace(" ", ""))
+                        float(second.replace(",", "").replace(" ", ""))
+                    except ValueError:
                         try:
-                            first_int = int(float(first.replace(",", "").replace(" ", "")))
-                            second_int = int(float(second.replace(",", "").replace(" ", "")))
+                            first_date = dateutil.parser.parse(first)
+                            second_date = dateutil.parser.parse(second)
                         except ValueError:
                             pass
                         else:
-                            if first_int >= self.year_bounds[0] and first_int <= self.year_bounds[1] and second_int >= self.year_bounds[0] and second_int <= self.year_bounds[1]:
-                                num_can_be_years_found += 1
+                            if second_date >= first_date:  # only makes sense for a range
+                                num_temporal_ranges_found += 1
+            return num_temporal_ranges_found
+
+        elif checker == "quant_range":
+            num_quant_ranges_found = 0
+            num_can_be_years_found = 0
+            for record in records:
+                if record.count("-") == 1:
+                    (first, second) = record.split("-")
+                    try:
+                        first_float = float(first.replace(",", "").replace(" ", ""))
+                        second_float = float(second.replace(",", "").replace(" ", ""))
+                    except ValueError:
+                        pass
+                    else:
+                        if second_float >= first_float:  # only makes sense for a range
+                            num_quant_ranges_found += 1
+                            # check if this can be a year range
+                            try:
+                                first_int = int(float(first.replace(",", "").replace(" ", "")))
+                                second_int = int(float(second.replace(",", "").replace(" ", "")))
+                            except ValueError:
+                                pass
+                            else:
+                                if first_int >= self.year_bounds[0] and first_int <= self.year_bounds[1] and second_int >= self.year_bounds[0] and second_int <= self.year_bounds[1]:
+                                    num_can_be_years_found += 1
+            return (num_quant_ranges_found, num_can_be_years_found)
+
+        elif checker == "money":
+            return sum(1 for record in records if record.startswith("$"))
+
+        elif checker == "percent":
+            return sum(1 for record in records if record.endswith("%"))
+
+        elif checker == "units":
+            # using pint package to check and parse for units
+            ureg = self.get_unit_registry()
+            freq_of_units = dict()
+            for record in records:
+                try:
+                    quant = ureg.parse_expression(record)
+                except:  # would like to give exact errors here but there are far too many to handle
+                    continue
+                if isinstance(quant, int) or isinstance(quant, float):  # already a number, no units
+                    continue
+                unit = str(quant.units)  # strings rather than pint units, so that counts can be sent between processes
+                freq_of_units[unit] = freq_of_units.get(unit, 0) + 1
+            return freq_of_units
+
+        elif checker == "numbers":
+            num_floats_found = 0
+            num_ints_found = 0
+            num_can_be_years_found = 0
+            for record in records:
+                try:
+                    float(record.replace(",", "").replace(" ", ""))
+                except ValueError:
+                    pass
+                else:
+                    num_floats_found += 1
+                    try:
+                        val = int(float(record.replace(",", "").replace(" ", "")))
+                    except ValueError:
+                        pass
+                    else:
+                        num_ints_found += 1
+                        if val >= self.year_bounds[0] and val <= self.year_bounds[1]:
+                            num_can_be_years_found += 1
+            return (num_floats_found, num_ints_found, num_can_be_years_found)
+
+        raise ValueError("unknown checker " + repr(checker))
+
+    # auxiliary function
+    # decides the category of a column (see classify) from the results of its checkers, which get_count(checker) returns
+    # @num_records: number of records in the column
+    # @records_to_check: number of (first) records that the match_checkers ran on
+    def classify_counts(self, col_idx, header, num_records, records_to_check, get_count):
+        # some tables have the first column corresponding to row number
+        if col_idx == 0 and get_count("row_num"):
+            # but sometimes this just corresponds to rank or position
+            if header.lower() == "rank" or header.lower() == "position" or header.lower() == "pos":
+                return "ORDINAL"
+            else:
+                return "ROW_NUM"
+
+        # ordinal checker
+        if get_count("ordinal") >= self.threshold_for_match * records_to_check:
+            return "ORDINAL"
+
+        # temporal checker
+        if get_count("temporal") >= self.threshold_for_match * records_to_check and "score" not in header.lower():
+            return "TEMPORAL"
+
+        # temporal range checker
+        if get_count("temporal_range") >= self.threshold_for_match * records_to_check:
+            return "TEMPORAL_RANGE"
+
+        # quant range checker
+        (num_quant_ranges_found, num_can_be_years_found) = get_count("quant_range")
         if num_quant_ranges_found >= self.threshold_for_match * records_to_check:
             if num_can_be_years_found >= self.threshold_for_match * records_to_check:
                 return "TEMPORAL_RANGE"
@@ -151,38 +455,20 @@ class Classifier:
                 return "QUANT_RANGE"
 
         # money checker
-        num_money_found = 0
-        for record_idx in range(records_to_check):
-            if records[record_idx].startswith("$"):
-                num_money_found += 1
-        if num_money_found >= self.threshold_for_match * records_to_check:
+        if get_count("money") >= self.threshold_for_match * records_to_check:
             return "QUANT_MONEY"
 
         # percentage checker
-        num_percent_found = 0
-        for record_idx in range(records_to_check):
-            if records[record_idx].endswith("%"):
-                num_percent_found += 1
-        if num_percent_found >= self.threshold_for_match * records_to_check:
+        if get_count("percent") >= self.threshold_for_match * records_to_check:
             return "QUANT_PERCENT"
 
-        # using pint package to check and parse for units
-        ureg = pint.UnitRegistry()
-        freq_of_units = dict()
-        for record_idx in range(records_to_check):
-            try:
-                quant = ureg.parse_expression(records[record_idx])
-            except:  # would like to give exact errors here but there are far too many to handle
-                continue
-            if isinstance(quant, int) or isinstance(quant, float):  # already a number, no units
-                continue
-            unit = quant.units
-            freq_of_units[unit] = freq_of_units.get(unit, 0) + 1
+        # unit checker
+        freq_of_units = get_count("units")
         if len(freq_of_units) > 0:
             sorted_freq_of_units = sorted(freq_of_units.items(), key=lambda x: x[1], reverse=True)
             (most_common_unit, most_common_freq) = sorted_freq_of_units[0]
             if most_common_freq >= self.threshold_for_match * records_to_check:
-                dim = dict(ureg.parse_expression(str(most_common_unit)).dimensionality)
+                dim = dict(self.get_unit_registry().parse_expression(most_common_unit).dimensionality)
                 if len(dim) == 1 and dim.get("[length]") == 1:
                     return "QUANT_LENGTH"
                 elif len(dim) == 1 and dim.get("[length]") == 2:
@@ -197,10 +483,7 @@ class Classifier:
 
         # preliminary categorical checker
         # https://datascience.stackexchange.com/questions/9892/how-can-i-dynamically-distinguish-between-categorical-data-and-numerical-data
-        distinct_records = set()
-        for record in records:
-            distinct_records.add(record)
-        if len(distinct_records) < self.categorical_distinctness_threshold * len(records):
+        if get_count("distinct") < self.categorical_distinctness_threshold * num_records:
             return "CATEGORICAL"
 
         # remains to distinguish QUANT_OTHER, CATEGORICAL, and STRING as best as possible
@@ -208,24 +491,7 @@ class Classifier:
         # classifies TEMPORAL if the column has only years, based on header again
         are_floats = False
         are_ints = False
-        num_floats_found = 0
-        num_ints_found = 0
-        num_can_be_years_found = 0
-        for record_idx in range(records_to_check):
-            try:
-                float(records[record_idx].replace(",", "").replace(" ", ""))
-            except ValueError:
-                pass
-            else:
-                num_floats_found += 1
-                try:
-                    val = int(float(records[record_idx].replace(",", "").replace(" ", "")))
-                except ValueError:
-                    pass
-                else:
-                    num_ints_found += 1
-                    if val >= self.year_bounds[0] and val <= self.year_bounds[1]:
-                        num_can_be_years_found += 1
+        (num_floats_found, num_ints_found, num_can_be_years_found) = get_count("numbers")
         if num_floats_found >= self.threshold_for_match * records_to_check:
             are_floats = True
             if num_ints_found >= self.threshold_for_match * records_to_check:
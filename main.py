@@ -1,73 +1,58 @@
 import reader
 import classifier
-import normalizer
+import os
+import subprocess
+import sys
+import tempfile
+import time
 
 # runs the classifier and the normalizer on all data tables, up to a limit of num_tables
 # prints to stdout the result for all columns that got classified into one of the filter_categories
-def classify_then_normalize(num_tables=None, filter_categories=[]):
+# num_workers is the number of processes used to classify each (large) .csv file, see DataTable.classify_cols
+#   - columns are then only read (one at a time) if they need to be normalized
+def classify_then_normalize(num_tables=None, filter_categories=[], num_workers=None):
+    import normalizer  # not needed by the other drivers
     rdr = reader.Reader()
     clssfr = classifier.Classifier()
     nmlzr = normalizer.Normalizer()
 
     data_tables = rdr.get_data_tables(num_tables)
     for data_table in data_tables:
-        col_idx = 0
-        while True:
-            col = data_table.get_col(col_idx)
-            if col == None:  # out of columns to read
-                break
-
-            (header, records) = col
-            category = clssfr.classify(col_idx, header, records)
-
-            # filtering of results
-            if category in filter_categories:
-                if category == "ROW_NUM":
-                    norm_records = nmlzr.normalize_quant_default(header, records)
-                elif category == "ORDINAL":
-                    norm_records = nmlzr.normalize_ordinal(header, records)
-                elif category == "TEMPORAL":
-                    (norm_records, vega_lite_timeunit) = nmlzr.normalize_temporal(header, records)
-                elif category == "TEMPORAL_RANGE":
-                    (norm_records_starts, norm_records_ends, vega_lite_timeunit) = nmlzr.normalize_temporal_range(header, records)
-                elif category == "QUANT_MONEY":
-                    (norm_records, units) = nmlzr.normalize_money(header, records)
-                elif category == "QUANT_PERCENT":
-                    norm_records = nmlzr.normalize_percent(header, records)
-                    units = "%"
-                elif category == "QUANT_LENGTH" or category == "QUANT_AREA" or category == "QUANT_SPEED":
-                    (norm_records, units) = nmlzr.normalize_quant_units(header, records)
-                elif category == "QUANT_OTHER":
-                    norm_records = nmlzr.normalize_quant_default(header, records)
-                    units = None
-                elif category == "QUANT_RANGE":
-                    (norm_records_starts, norm_records_ends) = nmlzr.normalize_quant_range(header, records)
-                    units = None
-                else:  # CATEGORICAL and STRING
-                    norm_records = nmlzr.normalize_default(header, records)
-
-                print("====================================================================================")
-                print("Column      :", data_table.csv_file, "(Column " + str(col_idx) + ")")
-                print("Header      :", repr(header))
-                meta = data_table.get_meta()
-                if meta != None:
-                    print("Meta        :", meta)
-                print("Original    :", records)
-                print()
+        if num_workers == None:
+            for (col_idx, (header, records)) in enumerate(data_table.iter_cols()):
+                category = clssfr.classify(col_idx, header, records)
+                if category in filter_categories:  # filtering of results
+                    print_normalized(nmlzr, data_table, col_idx, header, records, category)
+        else:
+            for (col_idx, (header, category)) in enumerate(data_table.classify_cols(clssfr, num_workers)):
+                if category in filter_categories:  # filtering of results
+                    (header, records) = data_table.get_col(col_idx)
+                    print_normalized(nmlzr, data_table, col_idx, header, records, category)
 
-                print("Classified  :", category)
-                if category.endswith("_RANGE"):
-                    print("Normalized s:", norm_records_starts)
-                    print("Normalized e:", norm_records_ends)
-                else:
-                    print("Normalized  :", norm_records)
-                if category.startswith("TEMPORAL"):
-                    print("VL timeunit :", vega_lite_timeunit)
-                elif category.startswith("QUANT_"):
-                    print("Units       :", units)
-                print()
+# normalizes a column of category, and prints the result to stdout
+def print_normalized(nmlzr, data_table, col_idx, header, records, category):
+    result = nmlzr.normalize(category, header, records)
 
-            col_idx += 1
+    print("====================================================================================")
+    print("Column      :", data_table.csv_file, "(Column " + str(col_idx) + ")")
+    print("Header      :", repr(header))
+    meta = data_table.get_meta()
+    if meta != None:
+        print("Meta        :", meta)
+    print("Original    :", records)
+    print()
+
+    print("Classified  :", category)
+    if category.endswith("_RANGE"):
+        print("Normalized s:", result["norm_records_starts"])
+        print("Normalized e:", result["norm_records_ends"])
+    else:
+        print("Normalized  :", result["norm_records"])
+    if category.startswith("TEMPORAL"):
+        print("VL timeunit :", result["vega_lite_timeunit"])
+    elif category.startswith("QUANT_"):
+        print("Units       :", result["units"])
+    print()
 
 # add verbose to print out all results, not verbose to print out only incorrect classifications
 # tests are currently manually-labeled columns of some of the .csv files
@@ -79,13 +64,7 @@ def classification_test(verbose=True):
     correct_count = 0
     total_count = 0
     for data_table in test_data_tables:
-        col_idx = 0
-        while True:
-            col = data_table.get_col(col_idx)
-            if col == None:  # out of columns to read
-                break
-
-            (header, records) = col
+        for (col_idx, (header, records)) in enumerate(data_table.iter_cols()):
             classified_type = clssfr.classify(col_idx, header, records)
             correct_type = data_table.get_type(col_idx)
             if verbose or classified_type != correct_type:
@@ -102,11 +81,108 @@ def classification_test(verbose=True):
                 print()
             total_count += 1
 
-            col_idx += 1
-
     print("===================================================")
     print("Overall result:", str(correct_count) + "/" + str(total_count), "(" + str(round(correct_count / total_count * 100, 2)) + "%)", "correct classifications")
 
+# checks that classifying .csv files in parallel (see DataTable.classify_cols) gives the same categories as classifying them
+# in this process, on files whose quotes make the byte range split hard, e.g. a literal quote in an unquoted value followed
+# by multi-line quoted values, and with both all records and only the first records checked
+def parallel_classify_test(num_workers=4, num_rows=5000):
+    test_files = {
+        "quoted_newlines.csv": "id,notes,group,amount\n" + "".join('%d,"first line %d\nsecond ""quoted"" line",g%d,$%d\n' % (i + 1, i, i % 3, i) for i in range(num_rows)),
+        "literal_quote.csv": "name,height,notes\nbob,5'10\",x\n" + "".join('p%d,%d,"first line %d\nsecond line"\n' % (i, i, i) for i in range(num_rows)),
+    }
+    num_passed = 0
+    num_tests = 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for (filename, contents) in test_files.items():
+            csv_filepath = os.path.join(temp_dir, filename)
+            with open(csv_filepath, "w") as file:
+                file.write(contents)
+            data_table = reader.DataTable(csv_filepath, None, None)
+            for clssfr in [classifier.Classifier(), classifier.Classifier(max_records_checked=100, categorical_exact_limit=100)]:
+                sequential_cols = data_table.classify_cols(clssfr)
+                # not through classify_cols, which would classify in this process on machines with fewer cores than num_workers
+                parallel_cols = data_table.classify_cols_parallel(clssfr, num_workers, min_bytes_per_worker=len(contents) // (2 * num_workers))
+                passed = parallel_cols == None or sequential_cols == parallel_cols  # None means classify_cols falls back to this process
+                print(filename.ljust(20), ("passed" if passed else "FAILED") + ("" if parallel_cols != None else " (fell back to this process)"), sequential_cols)
+                num_tests += 1
+                if passed:
+                    num_passed += 1
+    print("===================================================")
+    print("Overall result:", str(num_passed) + "/" + str(num_tests), "parallel classification tests passed")
+    return num_passed == num_tests
+
+# compares the time taken to classify the columns of a large generated .csv file in this process and with num_workers processes
+# (see DataTable.classify_cols), which needs multiple cores to be faster
+# returns the speedup (time in this process / parallel time)
+def parallel_classify_benchmark(num_rows=100000, num_workers=os.cpu_count()):
+    clssfr = classifier.Classifier()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_filepath = os.path.join(temp_dir, "benchmark.csv")
+        with open(csv_filepath, "w") as file:
+            file.write("id,date,notes,amount\n")
+            for i in range(num_rows):
+                file.write('%d,2019-%02d-%02d,"note %d, with a comma",%d.%02d\n' % (i + 1, i % 12 + 1, i % 28 + 1, i, i % 1000, i % 100))
+        file_size = os.path.getsize(csv_filepath)
+        data_table = reader.DataTable(csv_filepath, None, None)
+
+        start = time.perf_counter()
+        sequential_cols = data_table.classify_cols(clssfr)
+        sequential_s = time.perf_counter() - start
+        start = time.perf_counter()
+        parallel_cols = data_table.classify_cols(clssfr, num_workers, min_bytes_per_worker=file_size // (2 * num_workers))
+        parallel_s = time.perf_counter() - start
+
+    print("File size        :", str(round(file_size / 1024 / 1024, 1)), "MB,", num_rows, "rows")
+    print("This process     :", str(round(sequential_s, 2)), "s")
+    print("Parallel (" + str(num_workers) + " workers):", str(round(parallel_s, 2)), "s")
+    print("Same categories  :", sequential_cols == parallel_cols)
+    print("===================================================")
+    print("Speedup:", str(round(sequential_s / parallel_s, 2)) + "x", "on", os.cpu_count(), "cores")
+    return sequential_s / parallel_s
+
+# measures the cold-start cost of importing modules (in a fresh interpreter, using python -X importtime)
+# and constructing the Classifier and Normalizer (if among modules), which is paid by every short job and worker process
+# prints the slowest imports, and returns whether the import and construction time is within budget_ms
+def startup_benchmark(budget_ms=50, modules=["reader", "classifier", "normalizer"], num_slowest=10):
+    constructors = {"classifier": "classifier.Classifier()", "normalizer": "normalizer.Normalizer()"}
+    code = "import time; import " + ", ".join(modules) + "; start = time.perf_counter(); "
+    code += "".join(constructors[module] + "; " for module in modules if module in constructors)
+    code += "print(time.perf_counter() - start)"
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    construction_ms = float(proc.stdout) * 1000
+
+    # lines look like "import time:  self [us] |  cumulative [us] | <indentation>package"
+    imports = []
+    import_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        (self_us, cumulative_us, package) = line[len("import time:"):].split("|")
+        imports.append((int(self_us), package.strip()))
+        if package.strip() in modules and not package.startswith("  "):  # cumulative time covers nested imports, but not interpreter start-up
+            import_us += int(cumulative_us)
+
+    print("Slowest imports (self time):")
+    for (self_us, package) in sorted(imports, reverse=True)[:num_slowest]:
+        print("  " + str(round(self_us / 1000, 2)).rjust(8) + " ms  " + package)
+    total_ms = import_us / 1000 + construction_ms
+    print("===================================================")
+    print("Import time of " + ", ".join(modules) + ":", str(round(import_us / 1000, 2)), "ms")
+    print("Construction time:", str(round(construction_ms, 2)), "ms")
+    print("Total:", str(round(total_ms, 2)), "ms (budget " + str(budget_ms) + " ms)")
+    print("Interpreter wall time:", str(round(wall_ms, 2)), "ms")
+    return total_ms <= budget_ms
+
 if __name__ == "__main__":
+    # python main.py startup_benchmark (or parallel_classify_test) exits with a non-zero status if it fails, e.g. for CI
+    if sys.argv[1:] == ["startup_benchmark"]:
+        sys.exit(0 if startup_benchmark() else 1)
+    elif sys.argv[1:] == ["parallel_classify_test"]:
+        sys.exit(0 if parallel_classify_test() else 1)
     classify_then_normalize(None, ["ROW_NUM", "ORDINAL", "TEMPORAL", "TEMPORAL_RANGE", "QUANT_MONEY", "QUANT_PERCENT", "QUANT_LENGTH", "QUANT_AREA", "QUANT_SPEED", "QUANT_OTHER", "QUANT_RANGE", "CATEGORICAL", "STRING"])
     # classification_test(True)
+    # parallel_classify_benchmark()
@@ -1,23 +1,49 @@
-import num2words
 import re
+import collections
 import itertools
-import dateutil.parser
 import datetime
-import pint
 
 class Normalizer:
     # @ordinal_bound: bound for which we will be able to recognize ordinals
     def __init__(self, ordinal_bound=1000):
-        self.ordinal_normalizer_dict = dict()
-        for i in range(ordinal_bound):
-            self.ordinal_normalizer_dict[num2words.num2words(i, to="ordinal").lower()] = i
-            self.ordinal_normalizer_dict[num2words.num2words(i, to="ordinal_num")] = i
+        self.ordinal_bound = ordinal_bound
+        self.ordinal_normalizer_dict = None  # built on first use, see get_ordinal_normalizer_dict
+        self.ureg = None  # built on first use, see get_unit_registry
+        self.unit_conversion_cache = dict()  # see get_unit_conversion
+        self.temporal_outputs = ["string", "datetime64", "epoch"]  # see normalize_temporal
+        # <number> <unit expression>, where the unit expression starts with a letter (or is empty)
+        self.quant_units_regex = re.compile(r"^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*((?:[^\W\d].*?)?)\s*$")
+
+    # num2words and pint are imported here rather than at module load (as is dateutil in find_candidate_date_formats)
+    # so that only the normalize_* functions that need them pay for them
+    def get_ordinal_normalizer_dict(self):
+        if self.ordinal_normalizer_dict == None:
+            import num2words
+            self.ordinal_normalizer_dict = dict()
+            for i in range(self.ordinal_bound):
+                self.ordinal_normalizer_dict[num2words.num2words(i, to="ordinal").lower()] = i
+                self.ordinal_normalizer_dict[num2words.num2words(i, to="ordinal_num")] = i
+        return self.ordinal_normalizer_dict
+
+    def get_unit_registry(self):
+        if self.ureg == None:
+            import pint
+            self.ureg = pint.UnitRegistry()
+        return self.ureg
+
+    # builds everything that is otherwise built on first use (as in Classifier.warm)
+    def warm(self):
+        import dateutil.parser
+        import numpy
+        self.get_ordinal_normalizer_dict()
+        self.get_unit_registry()
 
     # auxiliary function
     # adapted from https://stackoverflow.com/questions/53892450/get-the-format-in-dateutil-parse
     # leverages dateutil.parser's parse function, then matches returned date against tokens of date_str (backwards engineering)
     # returns a tuple of equal-length lists (specifier_strings, specifier_types_used)
     def find_candidate_date_formats(self, date_str):
+        import dateutil.parser
         # correct date according to dateutil.parser
         try:
             date = dateutil.parser.parse(date_str)
@@ -131,13 +157,66 @@ class Normalizer:
             vega_lite_timeunit = "hoursminutesseconds"
         return (best_normalized_format, vega_lite_timeunit)
 
+    # auxiliary function
+    # parses @record with the first of @sorted_date_formats (precedence) that is among its candidate @date_formats
+    # returns a datetime, or None if the record cannot be parsed
+    def parse_temporal_record(self, record, date_formats, sorted_date_formats):
+        for date_format in sorted_date_formats:  # precedence
+            if date_format in date_formats:  # current record can be read in that format
+                unpadded_date_format = date_format.replace("%-", "%")
+                return datetime.datetime.strptime(record, unpadded_date_format)
+        return None
+
+    # auxiliary function
+    # converts parsed @dts (None where @records cannot be parsed) into a numpy masked array, masked where they cannot be parsed
+    #  - @output "datetime64": datetime64 values at the resolution of @vega_lite_timeunit (e.g. datetime64[M] for "yearmonth")
+    #  - @output "epoch": int64 values, counting units of that same resolution since 1970-01-01
+    # timeunits without a year (or date) use the defaults of datetime.strptime, i.e. 1900-01-01, and "day" is the weekday within that week
+    def to_numeric_temporal(self, records, dts, vega_lite_timeunit, output):
+        import numpy
+        timeunit_resolutions = {
+            "year": "Y",
+            "yearmonth": "M",
+            "yearmonthdate": "D",
+            "yearmonthdatehours": "h",
+            "yearmonthdatehoursminutes": "m",
+            "yearmonthdatehoursminutesseconds": "s",
+            "month": "M",
+            "monthdate": "D",
+            "day": "D",
+            "hoursminutes": "m",
+            "hoursminutesseconds": "s",
+        }
+        if vega_lite_timeunit == "day":  # strptime ignores the weekday, so it is recovered from dateutil instead
+            import dateutil.parser
+            monday = datetime.datetime(1900, 1, 1)
+            dts = [None if dts[record_idx] == None else monday + datetime.timedelta(days=dateutil.parser.parse(records[record_idx]).weekday()) for record_idx in range(len(records))]
+        values = numpy.array(dts, dtype="datetime64[" + timeunit_resolutions[vega_lite_timeunit] + "]")  # None becomes NaT
+        mask = numpy.isnat(values)
+        if output == "epoch":
+            values = values.astype("int64")
+        return numpy.ma.MaskedArray(values, mask=mask)
+
+    # auxiliary function
+    # returns the numeric output (as in to_numeric_temporal) for records that cannot be normalized, i.e. fully masked
+    # or @records themselves for "string" output
+    def unnormalized_temporal(self, records, output):
+        import numpy
+        if output == "string":
+            return records
+        values = numpy.full(len(records), numpy.datetime64("NaT"), dtype="datetime64[s]")
+        if output == "epoch":
+            values = values.astype("int64")
+        return numpy.ma.MaskedArray(values, mask=numpy.ones(len(records), dtype=bool))
+
     ############################################################################
     # returns (norm_records)
     def normalize_ordinal(self, header, records):
+        ordinal_normalizer_dict = self.get_ordinal_normalizer_dict()
         norm_records = []
         for record in records:
-            if record.lower() in self.ordinal_normalizer_dict:
-                norm_records.append(self.ordinal_normalizer_dict[record.lower()])
+            if record.lower() in ordinal_normalizer_dict:
+                norm_records.append(ordinal_normalizer_dict[record.lower()])
             else:
                 try:
                     norm_records.append(int(float(record.replace(",", "").replace(" ", ""))))
@@ -147,7 +226,10 @@ class Normalizer:
 
     ############################################################################
     # returns (norm_records, vega_lite_timeunit)
-    def normalize_temporal(self, header, records):
+    # @output: "string" for norm_records to be strings, or "datetime64"/"epoch" for a numeric array (see to_numeric_temporal)
+    def normalize_temporal(self, header, records, output="string"):
+        if output not in self.temporal_outputs:
+            raise ValueError("unknown temporal output " + repr(output) + ", expected one of " + ", ".join(self.temporal_outputs))
         # finding most common date format applicable throughout list of records
         date_formats_arr = [self.find_candidate_date_formats(record) for record in records]
         date_formats_used = dict()
@@ -157,32 +239,33 @@ class Normalizer:
                 date_formats_used[date_formats[i]] = date_formats_used.get(date_formats[i], 0) + 1
                 date_formats_to_specifier_types[date_formats[i]] = specifier_types[i]
         if len(date_formats_used) == 0:  # no candidate date formats throughout records
-            return (records, None)
+            return (self.unnormalized_temporal(records, output), None)
         sorted_date_formats = [x[0] for x in sorted(date_formats_used.items(), key=lambda x: x[1], reverse=True)]
 
         best_specifier_types = date_formats_to_specifier_types[sorted_date_formats[0]]
         (best_normalized_format, vega_lite_timeunit) = self.choose_temporal_format(best_specifier_types)
         if best_normalized_format == None: # some other weird combination of specifier types that is very unconventional, do not normalize
-            return (records, None)
+            return (self.unnormalized_temporal(records, output), None)
 
         # normalizing records, taking precedence of date formats based on order in sorted_date_formats
+        dts = [self.parse_temporal_record(records[record_idx], date_formats_arr[record_idx][0], sorted_date_formats) for record_idx in range(len(records))]
+        if output != "string":
+            return (self.to_numeric_temporal(records, dts, vega_lite_timeunit, output), vega_lite_timeunit)
         norm_records = []
         for record_idx in range(len(records)):
-            if date_formats_arr[record_idx] == ([], []):  # cannot be parsed
+            if dts[record_idx] == None:  # cannot be parsed
                 norm_records.append(records[record_idx])
-                continue
-            for date_format in sorted_date_formats:  # precedence
-                if date_format in date_formats_arr[record_idx][0]:  # current record can be read in that format
-                    unpadded_date_format = date_format.replace("%-", "%")
-                    dt = datetime.datetime.strptime(records[record_idx], unpadded_date_format)
-                    norm_records.append(dt.strftime(best_normalized_format))
-                    break
+            else:
+                norm_records.append(dts[record_idx].strftime(best_normalized_format))
 
         return (norm_records, vega_lite_timeunit)
 
     ############################################################################
     # returns (norm_records_starts, norm_records_ends, vega_lite_timeunit)
-    def normalize_temporal_range(self, header, records):
+    # @output: as in normalize_temporal
+    def normalize_temporal_range(self, header, records, output="string"):
+        if output not in self.temporal_outputs:
+            raise ValueError("unknown temporal output " + repr(output) + ", expected one of " + ", ".join(self.temporal_outputs))
         # splitting the range
         records_start = []
         records_end = []
@@ -205,40 +288,34 @@ class Normalizer:
                 date_formats_used[date_formats[i]] = date_formats_used.get(date_formats[i], 0) + 1
                 date_formats_to_specifier_types[date_formats[i]] = specifier_types[i]
         if len(date_formats_used) == 0:  # no candidate date formats throughout records
+            if output != "string":
+                return (self.unnormalized_temporal(records, output), self.unnormalized_temporal(records, output), None)
             return (records, [], None)
         sorted_date_formats = [x[0] for x in sorted(date_formats_used.items(), key=lambda x: x[1], reverse=True)]
 
         best_specifier_types = date_formats_to_specifier_types[sorted_date_formats[0]]
         (best_normalized_format, vega_lite_timeunit) = self.choose_temporal_format(best_specifier_types)
         if best_normalized_format == None: # some other weird combination of specifier types that is very unconventional, do not normalize
+            if output != "string":
+                return (self.unnormalized_temporal(records, output), self.unnormalized_temporal(records, output), None)
             return (records, [], None)
 
         # normalizing records, taking precedence of date formats based on order in sorted_date_formats
+        dts_start = [self.parse_temporal_record(records_start[record_idx], date_formats_arr_start[record_idx][0], sorted_date_formats) for record_idx in range(len(records))]
+        dts_end = [self.parse_temporal_record(records_end[record_idx], date_formats_arr_end[record_idx][0], sorted_date_formats) for record_idx in range(len(records))]
+        if output != "string":
+            return (self.to_numeric_temporal(records_start, dts_start, vega_lite_timeunit, output), self.to_numeric_temporal(records_end, dts_end, vega_lite_timeunit, output), vega_lite_timeunit)
         norm_records_starts = []
         norm_records_ends = []
         for record_idx in range(len(records)):
-            start_done = False
-            end_done = False
-            if date_formats_arr_start[record_idx] == ([], []):  # cannot be parsed
+            if dts_start[record_idx] == None:  # cannot be parsed
                 norm_records_starts.append(records_start[record_idx])
-                start_done = True
-            if date_formats_arr_end[record_idx] == ([], []):  # cannot be parsed
+            else:
+                norm_records_starts.append(dts_start[record_idx].strftime(best_normalized_format))
+            if dts_end[record_idx] == None:  # cannot be parsed
                 norm_records_ends.append(records_end[record_idx])
-                end_done = True
-            if not start_done or not end_done:
-                for date_format in sorted_date_formats:  # precedence
-                    if not start_done and date_format in date_formats_arr_start[record_idx][0]:  # current record can be read in that format
-                        unpadded_date_format = date_format.replace("%-", "%")
-                        dt = datetime.datetime.strptime(records_start[record_idx], unpadded_date_format)
-                        norm_records_starts.append(dt.strftime(best_normalized_format))
-                        start_done = True
-                    if not end_done and date_format in date_formats_arr_end[record_idx][0]:  # current record can be read in that format
-                        unpadded_date_format = date_format.replace("%-", "%")
-                        dt = datetime.datetime.strptime(records_end[record_idx], unpadded_date_format)
-                        norm_records_ends.append(dt.strftime(best_normalized_format))
-                        end_done = True
-                    if start_done and end_done:
-                        break
+            else:
+                norm_records_ends.append(dts_end[record_idx].strftime(best_normalized_format))
 
         return (norm_records_starts, norm_records_ends, vega_lite_timeunit)
 
@@ -289,26 +366,104 @@ class Normalizer:
 
     ############################################################################
     # returns (norm_records, units)
-    def normalize_quant_units(self, header, records):
-        ureg = pint.UnitRegistry()
-        norm_records = []
-        freq_of_units = dict()
-        for record in records:
+    # every record is converted into one canonical unit, so that norm_records is a numpy masked float array of comparable values
+    #  - @category (as returned by Classifier.classify) picks the canonical unit, e.g. meters for "QUANT_LENGTH"
+    #  - without a (known) category, the most common unit among records is used as the canonical unit
+    #  - records without units are assumed to be in the most common unit
+    #  - records that cannot be parsed or converted are masked (as in to_numeric_temporal)
+    def normalize_quant_units(self, header, records, category=None):
+        import numpy
+        canonical_units_by_category = {"QUANT_LENGTH": "meter", "QUANT_AREA": "meter ** 2", "QUANT_SPEED": "meter / second"}
+        ureg = self.get_unit_registry()
+
+        # splitting each record into a magnitude and a unit expression, so that each distinct unit expression is only parsed once
+        # records that are not simply <number> <unit> are parsed in full by pint instead
+        magnitudes = numpy.full(len(records), numpy.nan)
+        unit_keys = []  # "" for records without units, None for unparseable records
+        for record_idx in range(len(records)):
+            match = self.quant_units_regex.match(records[record_idx])
+            if match != None and "+" not in match.group(2) and "-" not in match.group(2):
+                magnitudes[record_idx] = float(match.group(1))
+                unit_keys.append(match.group(2))
+                continue
             try:
-                quant = ureg.parse_expression(record)
+                quant = ureg.parse_expression(records[record_idx])
             except:  # would like to give exact errors here but there are far too many to handle
-                norm_records.append(record)
+                unit_keys.append(None)
             else:
                 if isinstance(quant, int) or isinstance(quant, float):  # already a number, no units
-                    norm_records.append(quant)
+                    magnitudes[record_idx] = quant
+                    unit_keys.append("")
                 else:
-                    norm_records.append(quant.magnitude)
-                    freq_of_units[quant.units] = freq_of_units.get(quant.units, 0) + 1
-        if len(freq_of_units) > 0:  # most common unit among records
-            ret_units = str(sorted(freq_of_units.items(), key=lambda x: x[1], reverse=True)[0][0])
-        else:
+                    magnitudes[record_idx] = quant.magnitude
+                    unit_keys.append(str(quant.units))
+
+        # unit expressions may contain a numeric factor themselves (e.g. "m * 2"), which is kept in unit_quants
+        unit_quants = dict()
+        freq_of_units = dict()
+        for (unit_key, freq) in collections.Counter(unit_keys).items():
+            if unit_key == None or unit_key == "":
+                continue
+            try:
+                unit_quants[unit_key] = ureg.parse_expression(unit_key)
+            except:
+                continue
+            if isinstance(unit_quants[unit_key], int) or isinstance(unit_quants[unit_key], float):  # e.g. "5 pi"
+                continue
+            units = unit_quants[unit_key].units
+            freq_of_units[units] = freq_of_units.get(units, 0) + freq
+        if len(freq_of_units) > 0:
+            most_common_units = sorted(freq_of_units.items(), key=lambda x: x[1], reverse=True)[0][0]
+            if category in canonical_units_by_category:
+                canonical_units = ureg.parse_units(canonical_units_by_category[category])
+            else:
+                canonical_units = most_common_units
+            (no_units_scale, no_units_offset) = self.get_unit_conversion(most_common_units, canonical_units)
+            ret_units = str(canonical_units)
+        else:  # no units among records, so nothing to convert
+            (no_units_scale, no_units_offset) = (1.0, 0.0)
             ret_units = header.replace("\n", " ").split(" ")[-1].replace("(", "").replace(")", "").replace("[", "").replace("]", "")  # hopefully the header contains the unit
-        return (norm_records, ret_units)
+
+        # conversions (scale and offset) of each distinct unit expression, then converting the whole column in one step
+        conversions_by_key = {None: (numpy.nan, numpy.nan), "": (no_units_scale, no_units_offset)}
+        for (unit_key, unit_quant) in unit_quants.items():
+            if isinstance(unit_quant, int) or isinstance(unit_quant, float):
+                conversions_by_key[unit_key] = (unit_quant * no_units_scale, no_units_offset)
+            else:
+                (scale, offset) = self.get_unit_conversion(unit_quant.units, canonical_units)
+                conversions_by_key[unit_key] = (unit_quant.magnitude * scale, offset)
+        conversions = numpy.array([conversions_by_key.get(unit_key, (numpy.nan, numpy.nan)) for unit_key in unit_keys], dtype=float).reshape(-1, 2)
+        norm_records = magnitudes * conversions[:, 0] + conversions[:, 1]
+        return (numpy.ma.MaskedArray(norm_records, mask=~numpy.isfinite(norm_records)), ret_units)
+
+    # auxiliary function
+    # returns (scale, offset) such that a magnitude x in @units is x * scale + offset in @canonical_units, or (nan, nan) if
+    # it cannot be converted
+    #   - the offset is 0 except for units with an offset, e.g. 10 degF is 10 * 5 / 9 - 160 / 9 degC, not 10 * 5 / 9 degC
+    # conversions are cached per (units, canonical_units), so a column with few distinct units only converts a few times
+    def get_unit_conversion(self, units, canonical_units):
+        import numpy
+        key = (str(units), str(canonical_units))
+        if key not in self.unit_conversion_cache:
+            ureg = self.get_unit_registry()
+            try:
+                conversion = self.get_affine_conversion(ureg, units, canonical_units)
+            except:  # would like to give exact errors here but there are far too many to handle
+                try:
+                    # pint recognizes <length>/h as <length>/planck_constant (see Classifier.classify), which is meant to be per hour
+                    hour_units = ureg.parse_units(str(units).replace("planck_constant", "hour"))
+                    conversion = self.get_affine_conversion(ureg, hour_units, canonical_units)
+                except:
+                    conversion = (numpy.nan, numpy.nan)
+            self.unit_conversion_cache[key] = conversion
+        return self.unit_conversion_cache[key]
+
+    # auxiliary function
+    # pint conversions are affine, so converting 0 and 1 gives the offset and the scale
+    def get_affine_conversion(self, ureg, units, canonical_units):
+        offset = ureg.Quantity(0.0, units).to(canonical_units).magnitude
+        scale = ureg.Quantity(1.0, units).to(canonical_units).magnitude - offset
+        return (scale, offset)
 
     ############################################################################
     # returns (norm_records)
@@ -350,3 +505,36 @@ class Normalizer:
     # returns (norm_records)
     def normalize_default(self, header, records):
         return records
+
+    ############################################################################
+    # dispatches to the normalize_* function for the given category (as returned by Classifier.classify)
+    # returns a dict with some of the keys "norm_records", "norm_records_starts", "norm_records_ends", "vega_lite_timeunit", "units"
+    #  - range categories have "norm_records_starts" and "norm_records_ends" instead of "norm_records"
+    #  - temporal categories have "vega_lite_timeunit", quantitative categories have "units"
+    # @temporal_output: passed as output to normalize_temporal and normalize_temporal_range
+    def normalize(self, category, header, records, temporal_output="string"):
+        result = dict()
+        if category == "ROW_NUM":
+            result["norm_records"] = self.normalize_quant_default(header, records)
+        elif category == "ORDINAL":
+            result["norm_records"] = self.normalize_ordinal(header, records)
+        elif category == "TEMPORAL":
+            (result["norm_records"], result["vega_lite_timeunit"]) = self.normalize_temporal(header, records, temporal_output)
+        elif category == "TEMPORAL_RANGE":
+            (result["norm_records_starts"], result["norm_records_ends"], result["vega_lite_timeunit"]) = self.normalize_temporal_range(header, records, temporal_output)
+        elif category == "QUANT_MONEY":
+            (result["norm_records"], result["units"]) = self.normalize_money(header, records)
+        elif category == "QUANT_PERCENT":
+            result["norm_records"] = self.normalize_percent(header, records)
+            result["units"] = "%"
+        elif category == "QUANT_LENGTH" or category == "QUANT_AREA" or category == "QUANT_SPEED":
+            (result["norm_records"], result["units"]) = self.normalize_quant_units(header, records, category)
+        elif category == "QUANT_OTHER":
+            result["norm_records"] = self.normalize_quant_default(header, records)
+            result["units"] = None
+        elif category == "QUANT_RANGE":
+            (result["norm_records_starts"], result["norm_records_ends"]) = self.normalize_quant_range(header, records)
+            result["units"] = None
+        else:  # CATEGORICAL and STRING
+            result["norm_records"] = self.normalize_default(header, records)
+        return result
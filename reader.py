@@ -1,6 +1,39 @@
 import os
 import csv
+import io
 import json
+import importlib.util
+import locale
+import mmap
+
+# compressed .csv files are recognized by these extensions (e.g. file.csv.gz), and decompressed as a stream when read
+# .zst is only recognized if the (optional) zstandard package is installed
+def get_compression_extensions():
+    compression_extensions = [".gz", ".bz2", ".xz"]
+    if importlib.util.find_spec("zstandard") != None:
+        compression_extensions.append(".zst")
+    return compression_extensions
+
+# opens @csv_file in text mode, decompressing it in a single pass if it is compressed
+# @buffer_size: size of the read buffer in front of the decompressor, so that it is fed (and read from) in large chunks
+def open_csv(csv_file, buffer_size=1024 * 1024):
+    extension = os.path.splitext(csv_file)[1]
+    if extension == ".gz":
+        import gzip
+        raw_file = gzip.open(csv_file, "rb")
+    elif extension == ".bz2":
+        import bz2
+        raw_file = bz2.open(csv_file, "rb")
+    elif extension == ".xz":
+        import lzma
+        raw_file = lzma.open(csv_file, "rb")
+    elif extension == ".zst":
+        import zstandard
+        raw_file = zstandard.ZstdDecompressor().stream_reader(open(csv_file, "rb"), read_size=buffer_size, closefd=True)
+    else:
+        return open(csv_file)
+    # decoding the same way as open() in text mode would, so values match uncompressed files
+    return io.TextIOWrapper(io.BufferedReader(raw_file, buffer_size), encoding=locale.getpreferredencoding(False))
 
 # just a convenient data structure to associate the different physical files together
 class DataTable:
@@ -12,7 +45,7 @@ class DataTable:
     def get_col(self, col_idx):
         header = None
         col = []
-        with open(self.csv_file) as file:
+        with open_csv(self.csv_file) as file:
             csv_reader = csv.reader(file)
             for row in csv_reader:
                 try:
@@ -25,6 +58,85 @@ class DataTable:
                     col.append(value.strip())
         return (header, col)
 
+    # returns a list of (header, records) for every column, reading (and decompressing) the .csv file in a single pass
+    # like get_col, a column only exists if every row has a value for it
+    def get_cols(self):
+        with open_csv(self.csv_file) as file:
+            cols = rows_to_cols(csv.reader(file))
+        if cols == None:  # empty file
+            return []
+        merged_cols = []
+        for col in cols:
+            header = col.pop(0)  # first row of the file is the header
+            merged_cols.append((header, col))
+        return merged_cols
+
+    # returns an iterable of (header, records) for every column
+    # files of up to @max_bytes_in_memory (on disk) are read in a single pass with get_cols, which holds all of their columns
+    # in memory at once, while larger files are read one column at a time with get_col, i.e. once for every column
+    def iter_cols(self, max_bytes_in_memory=256 * 1024 * 1024):
+        if os.path.getsize(self.csv_file) <= max_bytes_in_memory:
+            return self.get_cols()
+        return self.iter_cols_streaming()
+
+    # auxiliary function
+    def iter_cols_streaming(self):
+        col_idx = 0
+        while True:
+            col = self.get_col(col_idx)
+            if col == None:  # out of columns to read
+                return
+            yield col
+            col_idx += 1
+
+    # returns a list of (header, category) for every column, as classified by @clssfr (a Classifier)
+    # @num_workers: number of processes that classify the file in parallel, each summarizing the columns of a byte range of
+    #   the file (see Classifier.summarize), so that only counts and sketches are sent back to this process, not records
+    #   - None or 1 means the columns are read and classified in this process
+    #   - it is capped at the number of cores, so single-core machines always classify in this process
+    #   - compressed files are always classified in this process, since they cannot be split into byte ranges
+    #   - if any byte range does not parse cleanly (see parse_byte_range), the columns are classified in this process instead
+    # @min_bytes_per_worker: files are only split into ranges at least this large, so small files are not worth the process overhead
+    def classify_cols(self, clssfr, num_workers=None, min_bytes_per_worker=64 * 1024 * 1024):
+        file_size = os.path.getsize(self.csv_file)
+        is_compressed = os.path.splitext(self.csv_file)[1] in get_compression_extensions()
+        classified_cols = None
+        if num_workers != None:  # more workers than cores only adds process overhead
+            num_workers = min(num_workers, os.cpu_count() or 1)
+        if num_workers != None and num_workers > 1 and file_size >= 2 * min_bytes_per_worker and not is_compressed:
+            classified_cols = self.classify_cols_parallel(clssfr, num_workers, min_bytes_per_worker)
+        if classified_cols == None:
+            classified_cols = [(header, clssfr.classify(col_idx, header, records)) for (col_idx, (header, records)) in enumerate(self.iter_cols())]
+        return classified_cols
+
+    # auxiliary function
+    # classifies the columns of the (uncompressed) .csv file from the merged summaries of byte ranges, in a pool of @num_workers processes
+    # returns a list of (header, category) for every column, or None if the split cannot be trusted
+    # the split in find_row_boundaries assumes that quotes only appear around quoted values, so a literal quote within
+    # an unquoted value (e.g. 5'10") puts later boundaries inside quoted values, which the checks here catch
+    def classify_cols_parallel(self, clssfr, num_workers, min_bytes_per_worker):
+        num_ranges = min(num_workers, os.path.getsize(self.csv_file) // min_bytes_per_worker)
+        with open(self.csv_file, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                boundaries = find_row_boundaries(mm, num_ranges)
+        byte_ranges = [(clssfr, self.csv_file, boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+        import multiprocessing  # only imported when actually classifying in parallel, since it is slow to import
+        with multiprocessing.Pool(min(num_workers, len(byte_ranges))) as pool:
+            results = pool.starmap(summarize_byte_range, byte_ranges)
+
+        (is_clean, headers, _) = results[0]
+        if not is_clean or headers == None:  # headers is None for an empty file
+            return None
+        for (is_clean, _, summaries) in results:
+            if not is_clean or (summaries != None and len(summaries) != len(headers)):
+                return None
+        classified_cols = []
+        for col_idx in range(len(headers)):
+            summaries = [range_summaries[col_idx] for (_, _, range_summaries) in results if range_summaries != None]
+            summary = clssfr.merge_summaries(col_idx, summaries)
+            classified_cols.append((headers[col_idx], clssfr.classify_summary(col_idx, headers[col_idx], summary)))
+        return classified_cols
+
     def get_meta(self):
         if self.meta_file == None:
             return None
@@ -41,13 +153,99 @@ class DataTable:
                 return None
             return types[col_idx].strip()
 
+# auxiliary function
+# parses rows of the .csv file within [start, end) bytes (which should be row boundaries) into columns, as in rows_to_cols
+# returns (is_clean, cols), where is_clean is whether the range ended outside of a quoted value and all of its rows
+# have the same number of values, i.e. whether [start, end) were very likely real row boundaries
+def parse_byte_range(csv_file, start, end):
+    with open(csv_file, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    # decoding the same way as open() in text mode would, so values match get_col
+    text_file = io.TextIOWrapper(io.BytesIO(data), encoding=locale.getpreferredencoding(False))
+    row_lengths = set()
+    def rows():
+        for row in csv.reader(text_file, strict=True):  # strict, so that ending inside a quoted value raises csv.Error
+            row_lengths.add(len(row))
+            yield row
+    try:
+        cols = rows_to_cols(rows())
+    except csv.Error:
+        return (False, None)
+    return (len(row_lengths) <= 1, cols)
+
+# auxiliary function
+# summarizes (see Classifier.summarize) the columns of the rows within [start, end) bytes of the .csv file, using @clssfr
+# returns (is_clean, headers, summaries), as in parse_byte_range
+#  - headers is the first row for the byte range at the start of the file, and None otherwise
+#  - summaries is a list of summaries for each column, or None if there are no rows
+def summarize_byte_range(clssfr, csv_file, start, end):
+    (is_clean, cols) = parse_byte_range(csv_file, start, end)
+    if not is_clean or cols == None:
+        return (is_clean, None, None)
+    headers = None
+    if start == 0:
+        headers = [col.pop(0) for col in cols]
+    return (True, headers, [clssfr.summarize(col_idx, cols[col_idx]) for col_idx in range(len(cols))])
+
+# auxiliary function
+# transposes @rows into a list of stripped values for each column (truncated to the shortest row), or None if there are no rows
+def rows_to_cols(rows):
+    cols = None
+    for row in rows:
+        if cols == None:
+            cols = [[] for _ in row]
+        elif len(row) < len(cols):
+            del cols[len(row):]
+        for col_idx in range(len(cols)):
+            cols[col_idx].append(row[col_idx].strip())
+    return cols
+
+# auxiliary function
+# splits the memory-mapped .csv file @mm into about @num_ranges byte ranges, that each start and end at a row boundary
+# a newline only ends a row if it is not inside a quoted value, which is the case if an even number of quotes precede it
+# (escaped quotes within a quoted value come in pairs, so they do not change this)
+# returns sorted list of boundary offsets, starting at 0 and ending at len(mm)
+def find_row_boundaries(mm, num_ranges, block_size=64 * 1024 * 1024):
+    def count_quotes(start, end):  # counts in blocks so that only one block is copied out of the mmap at a time
+        count = 0
+        for block_start in range(start, end, block_size):
+            count += mm[block_start:min(end, block_start + block_size)].count(b'"')
+        return count
+
+    file_size = len(mm)
+    boundaries = [0]
+    pos = 0
+    in_quotes = False
+    for range_idx in range(1, num_ranges):
+        target = file_size * range_idx // num_ranges
+        if target <= pos:  # previous boundary already went past this target
+            continue
+        in_quotes ^= count_quotes(pos, target) % 2 == 1
+        pos = target
+        while pos < file_size:
+            newline = mm.find(b"\n", pos)
+            if newline == -1:
+                pos = file_size
+                break
+            in_quotes ^= count_quotes(pos, newline) % 2 == 1
+            pos = newline + 1
+            if not in_quotes:
+                break
+        if pos >= file_size:
+            break
+        boundaries.append(pos)
+    boundaries.append(file_size)
+    return boundaries
+
 class Reader:
     def __init__(self):
         pass
 
-    # returns list of DataTable objects, i.e. csv files that are 1 folder deep from pwd
+    # returns list of DataTable objects, i.e. csv files (possibly compressed) that are 1 folder deep from pwd
     # limit is used to limit the number of DataTables retrieved
     def get_data_tables(self, limit=None):
+        compression_extensions = get_compression_extensions()
         data_tables = []
         num_data_tables = 0
         folders = [folder for folder in os.listdir(".") if os.path.isdir(folder)]
@@ -55,6 +253,10 @@ class Reader:
             files = set(os.listdir(folder))
             for file in files:
                 (filename, extension) = os.path.splitext(file)
+                if extension in compression_extensions:  # e.g. file.csv.gz, whose .meta and .types are file.meta and file.types
+                    if filename.endswith(".csv") and self.get_preferred_csv_file(filename[:-len(".csv")], files, compression_extensions) != file:
+                        continue  # another copy of the same table is preferred
+                    (filename, extension) = os.path.splitext(filename)
                 if extension == ".csv":
                     if (filename + ".meta") in files:
                         meta_filepath = os.path.join(folder, filename + ".meta")
@@ -73,6 +275,7 @@ class Reader:
     # returns a list of test DataTables
     # these are csv files that have been correctly (manually) classified
     def get_classifier_test_data_tables(self):
+        compression_extensions = get_compression_extensions()
         test_data_tables = []
         folders = [folder for folder in os.listdir(".") if os.path.isdir(folder)]
         for folder in folders:
@@ -81,6 +284,15 @@ class Reader:
                 (filename, extension) = os.path.splitext(file)
                 if extension == ".test":
                     test_filepath = os.path.join(folder, file)
-                    csv_filepath = os.path.join(folder, filename + ".csv")
+                    csv_filepath = os.path.join(folder, self.get_preferred_csv_file(filename, files, compression_extensions))
                     test_data_tables.append(DataTable(csv_filepath, None, test_filepath))
         return test_data_tables
+
+    # auxiliary function
+    # given the files in a folder, returns the file name of the table @filename, preferring an uncompressed .csv
+    # then compressed ones in the order of @compression_extensions (and file.csv if there are none, which may not exist)
+    def get_preferred_csv_file(self, filename, files, compression_extensions):
+        for extension in [""] + compression_extensions:
+            if (filename + ".csv" + extension) in files:
+                return filename + ".csv" + extension
+        return filename + ".csv"
@@ -0,0 +1,226 @@
+import reader
+import classifier
+import normalizer
+import collections
+import json
+import math
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+# keeps a bounded window of recent request latencies (in seconds) and reports percentiles over it
+class LatencyMetrics:
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.num_requests += 1
+
+    def record_batch(self):
+        with self.lock:
+            self.num_batches += 1
+
+    # nearest-rank percentile, @p in [0, 100]
+    def percentile(self, p):
+        with self.lock:
+            sorted_latencies = sorted(self.latencies)
+        if len(sorted_latencies) == 0:
+            return None
+        rank = max(0, min(len(sorted_latencies) - 1, math.ceil(p / 100 * len(sorted_latencies)) - 1))
+        return sorted_latencies[rank]
+
+    def summary(self):
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        return {
+            "num_requests": self.num_requests,
+            "num_batches": self.num_batches,
+            "p50_ms": None if p50 == None else round(p50 * 1000, 3),
+            "p99_ms": None if p99 == None else round(p99 * 1000, 3),
+        }
+
+# a resident service that keeps warm Classifier and Normalizer instances around, so that the import and
+# ordinal table construction costs are paid once instead of on every run of main.py
+# requests are JSON objects (one per line) with an "op" field, and an optional "id" that is echoed in the response
+#  - {"op": "column", "header": ..., "records": [...], "col_idx": 0}
+#  - {"op": "table", "path": "folder/file.csv"}
+#  "column" and "table" requests may also set "temporal_output" (see Normalizer.normalize_temporal), "string" by default
+#  - {"op": "metrics"} (metrics requests are left out of the latencies they report)
+# requests that queue up while a single worker thread (which owns the warm instances) is busy are taken together as a batch
+# within a batch, requests are still classified and normalized one at a time; batching only means that "table"
+# requests for the same file read it once, and that the worker wakes up once per batch rather than once per request
+class Server:
+    # @max_batch_size: max number of requests processed together in one batch
+    # @max_batch_wait: max time (seconds) to wait for more requests after the first one of a batch arrives
+    #   - by default a batch starts right away with the requests already queued, since requests are processed one at a
+    #     time anyway and waiting would only add latency
+    def __init__(self, max_batch_size=32, max_batch_wait=0):
+        self.clssfr = classifier.Classifier()
+        self.nmlzr = normalizer.Normalizer()
+        self.clssfr.warm()  # so that the first request does not pay for the lazily built tables and imports
+        self.nmlzr.warm()
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.metrics = LatencyMetrics()
+        self.pending = queue.Queue()
+        self.worker = threading.Thread(target=self.run_batches, daemon=True)
+        self.worker.start()
+
+    # queues @request, and calls @callback with the response (a dict) from the worker thread once it is done
+    def submit_async(self, request, callback):
+        self.pending.put((request, callback, time.perf_counter()))
+
+    # queues @request, and blocks until its response (a dict) is ready
+    def submit(self, request):
+        done = threading.Event()
+        response_holder = []
+        def callback(response):
+            response_holder.append(response)
+            done.set()
+        self.submit_async(request, callback)
+        done.wait()
+        return response_holder[0]
+
+    def run_batches(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.max_batch_size:  # takes whatever else is already queued, without waiting
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            deadline = time.perf_counter() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.process_batch(batch)
+
+    def process_batch(self, batch):
+        self.metrics.record_batch()
+        data_table_cache = dict()  # requests for the same table within a batch only read the file once
+        for (request, callback, submitted_time) in batch:
+            try:
+                response = self.handle_request(request, data_table_cache)
+            except Exception as e:  # a bad request should not bring down the whole service
+                response = {"error": type(e).__name__ + ": " + str(e)}
+            if isinstance(request, dict) and "id" in request:
+                response["id"] = request["id"]
+            if not (isinstance(request, dict) and request.get("op") == "metrics"):  # so that polling does not skew the latencies
+                self.metrics.record(time.perf_counter() - submitted_time)
+            callback(response)
+
+    # returns the response (a dict) for a single request
+    def handle_request(self, request, data_table_cache):
+        op = request.get("op")
+        if op == "column":
+            return self.classify_then_normalize(request.get("col_idx", 0), request["header"], request["records"], request.get("temporal_output", "string"))
+        elif op == "table":
+            path = request["path"]
+            if path not in data_table_cache:
+                data_table_cache[path] = self.read_columns(path)
+            columns = []
+            for (col_idx, (header, records)) in enumerate(data_table_cache[path]):
+                column = self.classify_then_normalize(col_idx, header, records, request.get("temporal_output", "string"))
+                column["header"] = header
+                columns.append(column)
+            return {"columns": columns}
+        elif op == "metrics":
+            return self.metrics.summary()
+        else:
+            raise ValueError("unknown op " + repr(op))
+
+    # returns a list of (header, records) for all columns of the .csv file at @path
+    def read_columns(self, path):
+        return reader.DataTable(path, None, None).get_cols()
+
+    def classify_then_normalize(self, col_idx, header, records, temporal_output="string"):
+        category = self.clssfr.classify(col_idx, header, records)
+        response = self.nmlzr.normalize(category, header, records, temporal_output)
+        response["category"] = category
+        return response
+
+    # serves JSONL requests from @infile, writing JSONL responses to @outfile as they complete
+    # responses may come back out of order, so clients should set "id" on their requests
+    def serve_stdio(self, infile=sys.stdin, outfile=sys.stdout):
+        def write(text):
+            outfile.write(text)
+            outfile.flush()
+        self.serve_lines(infile, write)
+
+    # serves JSONL requests over a Unix socket at @socket_path, one thread per connection
+    # as with serve_stdio, requests on a connection are queued without waiting for earlier responses, so that they
+    # can be batched with each other as well as with requests from other connections
+    def serve_unix_socket(self, socket_path):
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                def write(text):
+                    self.wfile.write(text.encode())
+                    self.wfile.flush()
+                server.serve_lines(self.rfile, write)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            unix_server.serve_forever()
+
+    # submits every JSONL request in @lines, and passes each JSONL response to @write as it completes
+    # returns once all responses have been written
+    def serve_lines(self, lines, write):
+        write_lock = threading.Lock()
+        num_outstanding = [0]
+        all_done = threading.Condition(write_lock)
+        def callback(response):
+            with write_lock:
+                write(to_json_line(response))
+                num_outstanding[0] -= 1
+                all_done.notify_all()
+        for line in lines:
+            if line.strip() == "" or line.strip() == b"":
+                continue
+            with write_lock:
+                num_outstanding[0] += 1
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                callback({"error": type(e).__name__ + ": " + str(e)})
+                continue
+            self.submit_async(request, callback)
+        with write_lock:  # drain outstanding requests before returning on EOF
+            all_done.wait_for(lambda: num_outstanding[0] == 0)
+
+# json.dumps does not know about non-builtin types (e.g. array outputs), so those are converted to lists or strings
+# nan and infinity are not valid JSON, so they are converted to null (as are masked values of masked arrays)
+def to_json_line(obj):
+    return json.dumps(replace_non_finite(obj), default=lambda x: replace_non_finite(x.tolist()) if hasattr(x, "tolist") else str(x), allow_nan=False) + "\n"
+
+def replace_non_finite(obj):
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    elif isinstance(obj, dict):
+        return {key: replace_non_finite(value) for (key, value) in obj.items()}
+    elif isinstance(obj, list) or isinstance(obj, tuple):
+        return [replace_non_finite(value) for value in obj]
+    return obj
+
+# usage: python server.py              (JSONL over stdin/stdout)
+#        python server.py <socket_path> (JSONL over a Unix socket)
+if __name__ == "__main__":
+    srvr = Server()
+    if len(sys.argv) > 1:
+        srvr.serve_unix_socket(sys.argv[1])
+    else:
+        srvr.serve_stdio()